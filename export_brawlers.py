@@ -1,15 +1,24 @@
 #!/usr/bin/env python3
 
 import os
+import heapq
 import json
+import re
 import requests
-import urllib.parse
 import sys
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from dataclasses import dataclass
 from datetime import datetime
+from itertools import accumulate
 from zoneinfo import ZoneInfo
 
+# orjson is optional; fall back to the stdlib json module when it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Credentials must be provided via environment variables for security
 # Trim whitespace and allow TAG to be provided with or without a leading '#'
 API_KEY = os.environ.get('BRAWL_API_KEY', '').strip()
@@ -20,6 +29,48 @@ OUTPUT_JSON = os.environ.get('OUTPUT_JSON') or 'frontend/public/brawlers.json'
 HISTORY_JSON = os.path.join(os.path.dirname(OUTPUT_JSON), 'hourly_changes.json')
 HISTORY_MAX = 24
 
+# Shared HTTP session so repeated API calls reuse pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.headers.update({
+    'Accept': 'application/json',
+    'User-Agent': 'Brawl Exporter/1.0'
+})
+_ADAPTER = HTTPAdapter(
+    max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]),
+    pool_connections=10,
+    pool_maxsize=10
+)
+_SESSION.mount('https://', _ADAPTER)
+_SESSION.mount('http://', _ADAPTER)
+
+# Characters stripped by to_int when a value is not a plain integer
+_NON_INT_RE = re.compile(r'[^0-9-]')
+
+
+@dataclass(slots=True)
+class Brawler:
+    """A single brawler row; converted to the exported column names by to_dict()."""
+    name: str
+    power: int
+    trophies: int
+    gadgets: int
+    star_powers: int
+    gears: int
+    points_to_max: int
+    coins_to_max: int
+
+    def to_dict(self):
+        return {
+            'Brawler': self.name,
+            'Power': self.power,
+            'Trophies': self.trophies,
+            'Gadgets': self.gadgets,
+            'Star Powers': self.star_powers,
+            'Gears': self.gears,
+            'Points to MAX': self.points_to_max,
+            'Coins to MAX': self.coins_to_max
+        }
+
 
 def to_int(s, default=0):
     if s is None:
@@ -27,44 +78,45 @@ def to_int(s, default=0):
     try:
         return int(s)
     except Exception:
-        s = ''.join(ch for ch in str(s) if ch.isdigit() or ch == '-')
+        s = _NON_INT_RE.sub('', str(s))
         try:
             return int(s)
         except Exception:
             return default
 
 
+# Per-level upgrade costs (points, coins) to go from level L to L+1
+_UPGRADE_COSTS = [
+    (20, 20),    # 1->2
+    (30, 35),    # 2->3
+    (50, 75),    # 3->4
+    (80, 140),   # 4->5
+    (130, 290),  # 5->6
+    (210, 480),  # 6->7
+    (340, 800),  # 7->8
+    (550, 1250), # 8->9
+    (890, 1875), # 9->10
+    (1440, 2800) # 10->11
+]
+# Remaining (points, coins) to reach power 11, indexed by current power - 1; the last entry is power 11
+_COSTS_TO_MAX = list(accumulate(
+    reversed(_UPGRADE_COSTS),
+    lambda acc, cost: (acc[0] + cost[0], acc[1] + cost[1]),
+    initial=(0, 0)
+))[::-1]
+
+
 def points_and_coins_to_max_for_power(power):
     """Return (points_to_max, coins_to_max) required to reach power 11 from current power.
     Upgrade costs are per-level (cost to go from level L to L+1) as provided.
     """
-    upgrade_costs = [
-        (20, 20),    # 1->2
-        (30, 35),    # 2->3
-        (50, 75),    # 3->4
-        (80, 140),   # 4->5
-        (130, 290),  # 5->6
-        (210, 480),  # 6->7
-        (340, 800),  # 7->8
-        (550, 1250), # 8->9
-        (890, 1875), # 9->10
-        (1440, 2800) # 10->11
-    ]
-
     p = to_int(power, default=1)
     if p < 1:
         p = 1
     if p >= 11:
         return 0, 0
 
-    total_points = 0
-    total_coins = 0
-    for lvl in range(p, 11):
-        pts, coins = upgrade_costs[lvl - 1]
-        total_points += pts
-        total_coins += coins
-
-    return total_points, total_coins
+    return _COSTS_TO_MAX[p - 1]
 
 
 def fetch_player_from_brawlstars(tag, api_key, timeout=20):
@@ -76,24 +128,17 @@ def fetch_player_from_brawlstars(tag, api_key, timeout=20):
     if not api_key:
         raise RuntimeError('API key is required to fetch from Brawl Stars API')
 
-    # Ensure tag is safe for use in a URL; the API expects the tag to be prefixed with '%23' (encoded '#')
-    safe_tag = urllib.parse.quote(tag, safe='')
+    # Tags are alphanumeric, so they can go into the URL without quoting;
+    # the API expects the tag to be prefixed with '%23' (encoded '#')
+    tag = tag.lstrip('#')
+    if not (tag.isascii() and tag.isalnum()):
+        raise RuntimeError(f'Invalid player tag {tag!r}: must contain only letters and digits')
     base = PROXY_BASE or 'https://bsproxy.royaleapi.dev'
-    url = f"{base}/v1/players/%23{safe_tag}"
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Accept': 'application/json',
-        'User-Agent': 'Brawl Exporter/1.0'
-    }
-
-    session = requests.Session()
-    retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-    adapter = HTTPAdapter(max_retries=retries)
-    session.mount('https://', adapter)
-    session.mount('http://', adapter)
+    url = f"{base}/v1/players/%23{tag}"
+    headers = {'Authorization': f'Bearer {api_key}'}
 
     try:
-        r = session.get(url, headers=headers, timeout=timeout)
+        r = _SESSION.get(url, headers=headers, timeout=timeout)
         r.raise_for_status()
     except requests.exceptions.HTTPError as e:
         status = getattr(e.response, 'status_code', None)
@@ -110,7 +155,7 @@ def fetch_player_from_brawlstars(tag, api_key, timeout=20):
 
 
 def parse_player_json(data):
-    """Convert Brawl Stars player JSON into the rows structure used by the project.
+    """Convert Brawl Stars player JSON into a list of Brawler rows.
     """
     rows = []
     if not isinstance(data, dict):
@@ -133,16 +178,16 @@ def parse_player_json(data):
 
         points_to_max, coins_to_max = points_and_coins_to_max_for_power(power)
 
-        rows.append({
-            'Brawler': name,
-            'Power': power,
-            'Trophies': trophies,
-            'Gadgets': gadgets,
-            'Star Powers': star_powers,
-            'Gears': gears,
-            'Points to MAX': points_to_max,
-            'Coins to MAX': coins_to_max
-        })
+        rows.append(Brawler(
+            name=name,
+            power=power,
+            trophies=trophies,
+            gadgets=gadgets,
+            star_powers=star_powers,
+            gears=gears,
+            points_to_max=points_to_max,
+            coins_to_max=coins_to_max
+        ))
 
     return rows
 
@@ -150,6 +195,9 @@ def parse_player_json(data):
 def load_json_safe(path):
     """Load JSON data from a file, return None if any error occurs."""
     try:
+        if orjson is not None:
+            with open(path, 'rb') as f:
+                return orjson.loads(f.read())
         with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
     except Exception:
@@ -159,6 +207,10 @@ def load_json_safe(path):
 def save_json_safe(path, data):
     """Save JSON data to a file, creating directories as needed."""
     os.makedirs(os.path.dirname(path), exist_ok=True)
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        return
     with open(path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
@@ -172,32 +224,22 @@ def format_changes(prev_map, curr_map, max_lines=24):
     """Format the changes in trophies between two maps for display.
 
     - Excludes the synthetic 'TOTAL' row (case-insensitive) from the computed changes.
+    - Keeps the max_lines largest changes by magnitude (ties broken by name), largest first.
     - Returns (changes_list, total) where total is the sum of the diffs for the returned lines
       (i.e., only the displayed lines are included in the total).
     """
-    # calculate diffs for brawlers present in either
-    names = sorted(set(prev_map.keys()) | set(curr_map.keys()))
-    changes = []
-    included_diffs = []
-
-    for n in names:
-        if not n:
-            continue
-        # skip the synthetic total row (could be 'TOTAL' or other case variants)
-        if str(n).strip().upper() == 'TOTAL':
-            continue
-
-        prev = prev_map.get(n, 0)
-        curr = curr_map.get(n, 0)
-        diff = curr - prev
-        if diff != 0:
-            sign = '+' if diff > 0 else ''
-            changes.append(f"{n} {sign}{diff}")
-            included_diffs.append(diff)
-            if len(changes) >= max_lines:
-                break
-
-    total = sum(included_diffs)
+    # calculate diffs for brawlers present in either, skipping the synthetic total row
+    # (could be 'TOTAL' or other case variants)
+    diffs = [
+        (n, curr_map.get(n, 0) - prev_map.get(n, 0))
+        for n in prev_map.keys() | curr_map.keys()
+        if n and str(n).strip().upper() != 'TOTAL'
+    ]
+    diffs = [(n, d) for n, d in diffs if d]
+    top = heapq.nsmallest(max_lines, diffs, key=lambda x: (-abs(x[1]), str(x[0])))
+
+    changes = [f"{n} {'+' if d > 0 else ''}{d}" for n, d in top]
+    total = sum(d for _, d in top)
     return changes, total
 
 
@@ -223,6 +265,9 @@ def main():
         print('Error: BRAWL_TAG environment variable is not set or is empty.')
         print('Set it in your environment or GitHub Actions secrets as BRAWL_TAG (without the leading #).')
         sys.exit(2)
+    if not (TAG.isascii() and TAG.isalnum()):
+        print('Error: BRAWL_TAG must contain only letters and digits (optionally with a leading #).')
+        sys.exit(2)
 
     # show which API base will be used (helps with debugging proxy vs official API)
     print(f'Using API base: {PROXY_BASE}')
@@ -244,9 +289,9 @@ def main():
         return
 
     # compute totals and append TOTAL row
-    total_trophies = sum(to_int(r.get('Trophies')) for r in rows)
-    total_points = sum(to_int(r.get('Points to MAX')) for r in rows)
-    total_coins = sum(to_int(r.get('Coins to MAX')) for r in rows)
+    total_trophies = sum(b.trophies for b in rows)
+    total_points = sum(b.points_to_max for b in rows)
+    total_coins = sum(b.coins_to_max for b in rows)
 
     total_row = {
         'Brawler': 'TOTAL',
@@ -259,12 +304,12 @@ def main():
         'Coins to MAX': total_coins
     }
 
-    merged_records = rows + [total_row]
+    merged_records = [b.to_dict() for b in rows] + [total_row]
 
     # read previous output (if any) to compute trophy changes
     prev_records = load_json_safe(OUTPUT_JSON) or []
     prev_map = build_trophies_map(prev_records)
-    curr_map = build_trophies_map(rows)
+    curr_map = {b.name: b.trophies for b in rows}
 
     changes, total_diff = format_changes(prev_map, curr_map)
 
@@ -278,11 +323,15 @@ def main():
         'total': total_diff
     }
 
-    # write outputs
-    save_json_safe(OUTPUT_JSON, merged_records)
+    # write outputs; skip rewriting the export when its content is unchanged
+    if merged_records != prev_records:
+        save_json_safe(OUTPUT_JSON, merged_records)
+        print(f'Saved: {OUTPUT_JSON}')
+    else:
+        print(f'No changes to {OUTPUT_JSON}; not rewritten.')
 
     # Only update history if there were trophy changes; never delete older entries
-    if card_lines and len(card_lines) > 0:
+    if card_lines:
         history = load_json_safe(HISTORY_JSON) or []
         history.insert(0, card)
         # do NOT trim history here; keep all historical entries
@@ -291,8 +340,6 @@ def main():
     else:
         print('No trophy changes since last export; history not updated.')
 
-    print(f'Saved: {OUTPUT_JSON}')
-
 
 if __name__ == '__main__':
     main()
\ No newline at end of file